@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк: задержка покупки (create_license + add_transaction) во время
+онлайн-бэкапа licenses.db
+
+Запуск:  python bench_backup.py [кол-во ключей в базе] [кол-во покупок]
+Работает во временной папке, настоящую базу не трогает. Синхронизация
+с сервером отключается — меряется только работа с SQLite.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import statistics
+
+# Боту при импорте нужен токен правильного формата, сеть не используется
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import main
+
+
+def purchase_latencies(count: int, stop: threading.Event = None) -> list:
+    """Выполнить до count покупок подряд, вернуть задержки в мс"""
+    latencies = []
+    for i in range(count):
+        if stop is not None and stop.is_set():
+            break
+        started = time.perf_counter()
+        key = main.create_license(i, "1month", "telegram_stars", "bench", "Bench")
+        main.add_transaction(i, "1month", main.PRICES["1month"]["stars"], "telegram_stars", key)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def report(title: str, latencies: list):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{title:<22} n={len(latencies):<5} "
+        f"p50={statistics.median(latencies):6.2f} мс  "
+        f"p95={p95:6.2f} мс  "
+        f"max={latencies[-1]:6.2f} мс"
+    )
+
+
+def populate(rows: int):
+    conn = main.sqlite3.connect(main.DB_FILE)
+    expires_at = main._license_expires_at("1month")
+    conn.executemany(
+        "INSERT INTO license_keys (key, user_id, plan, expires_at, payment_method) VALUES (?, ?, ?, ?, ?)",
+        ((f"BENCH-{i:012d}", i, "1month", expires_at, "bench") for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(rows: int, purchases: int):
+    workdir = tempfile.mkdtemp(prefix="bench_backup_")
+    os.chdir(workdir)
+    main.BACKUP_DIR = os.path.join(workdir, "backups")
+    main.sync_key_to_server = lambda *args, **kwargs: True
+    main.logger.disabled = True
+
+    try:
+        main.init_db()
+        populate(rows)
+        print(f"База: {os.path.getsize(main.DB_FILE) // 1024} КБ, ключей: {rows}")
+
+        report("Без бэкапа", purchase_latencies(purchases))
+
+        # Покупки идут, пока бэкап работает в соседнем потоке
+        done = threading.Event()
+        result = {}
+
+        def backup():
+            started = time.perf_counter()
+            result["path"] = main.backup_database(main.DB_FILE)
+            result["seconds"] = time.perf_counter() - started
+            done.set()
+
+        thread = threading.Thread(target=backup)
+        thread.start()
+        during = []
+        while not done.is_set():
+            during += purchase_latencies(purchases, stop=done)
+        thread.join()
+
+        report("Во время бэкапа", during)
+        verified = main.verify_backup(result["path"])
+        print(
+            f"Бэкап: {result['seconds']:.2f} с, "
+            f"{os.path.getsize(result['path']) // 1024} КБ, "
+            f"integrity={verified['integrity']}, license_keys={verified['tables']['license_keys']}"
+        )
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run(
+        rows=int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+        purchases=int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+    )
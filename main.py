@@ -6,14 +6,28 @@ Telegram Bot для продажи лицензий Timecyc Editor
 ЗАЩИЩЕННАЯ ВЕРСИЯ - с API ключом
 """
 
+import io
 import os
+import csv
+import glob
+import gzip
+import json
+import time
+import queue
+import atexit
+import random
+import re
+import shutil
 import sqlite3
 import secrets
 import asyncio
 import logging
+import tempfile
+import itertools
 import requests
-from datetime import datetime, timedelta
-from typing import Dict, List
+from datetime import datetime, timedelta, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
@@ -22,7 +36,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
-    LabeledPrice, PreCheckoutQuery
+    LabeledPrice, PreCheckoutQuery, FSInputFile
 )
 
 # ============================================================================
@@ -48,6 +62,51 @@ API_SECRET_KEY = os.getenv("API_SECRET_KEY", "ЗАМЕНИТЕ_ЭТОТ_КЛЮЧ
 
 DB_FILE          = "licenses.db"
 
+# Пакетная выдача ключей и фоновая синхронизация с сервером
+BULK_MAX_KEYS    = int(os.getenv("BULK_MAX_KEYS", "5000"))
+BULK_CHUNK_SIZE  = 500    # ключей на один executemany
+BULK_OWNER_ID    = 0      # user_id пакетных ключей: склад, а не лицензии админа
+SYNC_BATCH_SIZE  = 50     # ключей за один проход синхронизации
+SYNC_INTERVAL    = 30     # секунд между проходами, если очередь пуста
+SYNC_MAX_ATTEMPTS = 10    # после стольких отказов ключ больше не отправляется
+
+# Экспорт таблиц для бухгалтерии
+EXPORT_CHUNK_SIZE = 1000  # строк на один fetchmany
+EXPORT_MAX_BYTES  = 50 * 1024 * 1024  # лимит Telegram на отправку файла ботом
+
+# Агрегаты выручки: таблица → формат корзины времени (UTC, как transactions.timestamp)
+ROLLUP_TABLES = {
+    "revenue_hourly": "%Y-%m-%d %H:00",
+    "revenue_daily":  "%Y-%m-%d",
+}
+TREND_DAYS       = 30
+
+# Сколько последних лицензий показывать в «Мои лицензии» (лимит сообщения — 4096 символов)
+MY_LICENSES_LIMIT = 15
+
+# Архив: истёкшие ключи и старые транзакции переносятся в отдельную базу
+ARCHIVE_DB_FILE         = "licenses_archive.db"
+ARCHIVE_KEYS_GRACE_DAYS = 30      # ключ уходит в архив через N дней после истечения
+ARCHIVE_TX_DAYS         = 365     # транзакции старше N дней уходят в архив
+ARCHIVE_BATCH_SIZE      = 500     # строк на одну транзакцию переноса
+ARCHIVE_PAUSE           = 0.5     # секунд между пачками
+ARCHIVE_INTERVAL        = 6 * 3600
+
+# Резервные копии: онлайн-бэкап SQLite маленькими шагами, без остановки записи
+BACKUP_DIR        = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL   = int(os.getenv("BACKUP_INTERVAL", str(6 * 3600)))
+BACKUP_KEEP       = int(os.getenv("BACKUP_KEEP", "14"))   # копий каждой базы
+BACKUP_PAGES      = 64      # страниц за один шаг backup
+BACKUP_STEP_PAUSE = 0.005   # секунд между шагами
+
+# Логи: JSON в фоновом потоке, секреты и ключи вырезаются
+LOG_LEVEL        = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE  = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))  # доля массовых INFO-событий в логе
+# Логгеры, INFO которых сэмплируются целиком: логгер → доля в логе
+LOG_SAMPLE_LOGGERS = {
+    "aiogram.event": LOG_SAMPLE_RATE,   # "Update id=... is handled" на каждый апдейт
+}
+
 PRICES = {
     "1month":   {"stars": 50,  "days": 30,    "name": "1 месяц"},
     "3months":  {"stars": 100, "days": 90,    "name": "3 месяца"},
@@ -58,7 +117,111 @@ PRICES = {
 # ЛОГИРОВАНИЕ
 # ============================================================================
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+# Ключ лицензии в логах: первый блок остаётся для поиска, остальное скрыто
+LICENSE_KEY_RE = re.compile(r"\b(PWEPER-[0-9A-F]{8})-[0-9A-F]{8}-[0-9A-F]{8}\b")
+
+# Стандартные поля LogRecord; всё остальное из extra={...} попадает в JSON
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample"}
+
+
+def redact(text: str) -> str:
+    for secret in (API_SECRET_KEY, BOT_TOKEN):
+        if secret:
+            text = text.replace(secret, "***")
+    return LICENSE_KEY_RE.sub(r"\1-****-****", text)
+
+
+def _redact_value(value):
+    """redact() для значения extra любой вложенности; прочие объекты — через str()"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return redact(value)
+    if isinstance(value, dict):
+        return {redact(str(k)): _redact_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_redact_value(v) for v in value]
+    return redact(str(value))
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON, все строки и вложенные значения проходят через redact()"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts":     datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level":  record.levelname,
+            "logger": record.name,
+            "msg":    redact(record.getMessage()),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_FIELDS:
+                data[name] = _redact_value(value)
+        if record.exc_info:
+            data["exc"] = redact(self.formatException(record.exc_info))
+        if record.stack_info:
+            data["stack"] = redact(self.formatStack(record.stack_info))
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только часть массовых INFO-записей
+
+    Сэмплируются все INFO логгеров из logger_rates (со своей долей) и записи
+    с пометкой extra={"sample": True} (с долей rate). WARNING и выше
+    проходят всегда.
+    """
+
+    def __init__(self, rate: float, logger_rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rate = rate
+        self.logger_rates = logger_rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.logger_rates.get(record.name)
+        if rate is None and getattr(record, "sample", False):
+            rate = self.rate
+        if rate is not None:
+            if random.random() >= rate:
+                return False
+            record.sample_rate = rate
+        return True
+
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare форматирует запись в вызывающем потоке. Здесь
+        # только подставляются аргументы, JSON и redact() — в QueueListener.
+        record = logging.makeLogRecord(vars(record))
+        record.msg  = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging() -> QueueListener:
+    """Корневой логгер пишет в очередь, вывод в stderr — в потоке QueueListener"""
+    log_queue = queue.SimpleQueue()
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, stream, respect_handler_level=True)
+
+    handler = _DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE, LOG_SAMPLE_LOGGERS))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 # ============================================================================
@@ -73,9 +236,51 @@ dp      = Dispatcher(storage=storage)
 # БАЗА ДАННЫХ SQLite
 # ============================================================================
 
+# Колонки общие для основной и архивной базы — порядок важен для INSERT ... SELECT *
+LICENSE_KEYS_COLUMNS = """
+    key            TEXT PRIMARY KEY,
+    user_id        INTEGER NOT NULL,
+    plan           TEXT NOT NULL,
+    created_at     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at     TIMESTAMP NOT NULL,
+    payment_method TEXT NOT NULL,
+    activated      INTEGER DEFAULT 0,
+    hwid           TEXT,
+    activated_at   TIMESTAMP,
+    synced         INTEGER DEFAULT 1,
+    issued_by      INTEGER,
+    sync_attempts  INTEGER DEFAULT 0,
+    last_sync_attempt TIMESTAMP
+"""
+
+# Колонки, добавленные после первой версии схемы: в старых базах (основной
+# и архивной) они дописываются в конец таблицы в этом же порядке
+LICENSE_KEYS_ADDED_COLUMNS = [
+    # Старые ключи без колонки synced считаем уже синхронизированными
+    ("synced",    "INTEGER DEFAULT 1"),
+    # Админ, выпустивший пакетный ключ
+    ("issued_by", "INTEGER"),
+    # Неудачные попытки фоновой синхронизации
+    ("sync_attempts",     "INTEGER DEFAULT 0"),
+    ("last_sync_attempt", "TIMESTAMP"),
+]
+
+TRANSACTIONS_COLUMNS = """
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id    INTEGER NOT NULL,
+    plan       TEXT NOT NULL,
+    amount     INTEGER NOT NULL,
+    method     TEXT NOT NULL,
+    license_key TEXT NOT NULL,
+    timestamp  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+"""
+
+
 def init_db():
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
+    # WAL: бэкап и чтение не блокируют запись (режим сохраняется в файле)
+    c.execute("PRAGMA journal_mode=WAL")
 
     c.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -87,48 +292,124 @@ def init_db():
         )
     """)
 
+    c.execute(f"CREATE TABLE IF NOT EXISTS license_keys ({LICENSE_KEYS_COLUMNS})")
+    for column, decl in LICENSE_KEYS_ADDED_COLUMNS:
+        _ensure_column(c, "license_keys", column, decl)
+    # Очередь синхронизации: давно не пробованные ключи первыми
     c.execute("""
-        CREATE TABLE IF NOT EXISTS license_keys (
-            key            TEXT PRIMARY KEY,
-            user_id        INTEGER NOT NULL,
-            plan           TEXT NOT NULL,
-            created_at     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at     TIMESTAMP NOT NULL,
-            payment_method TEXT NOT NULL,
-            activated      INTEGER DEFAULT 0,
-            hwid           TEXT,
-            activated_at   TIMESTAMP
-        )
+        CREATE INDEX IF NOT EXISTS idx_license_keys_sync_queue
+        ON license_keys (last_sync_attempt) WHERE synced = 0
     """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_license_keys_user ON license_keys (user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_license_keys_expires ON license_keys (expires_at)")
+
+    c.execute(f"CREATE TABLE IF NOT EXISTS transactions ({TRANSACTIONS_COLUMNS})")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)")
+
+    for table in ROLLUP_TABLES:
+        c.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket   TEXT NOT NULL,
+                plan     TEXT NOT NULL,
+                method   TEXT NOT NULL,
+                tx_count INTEGER NOT NULL DEFAULT 0,
+                stars    INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, plan, method)
+            ) WITHOUT ROWID
+        """)
 
     c.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            id         INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id    INTEGER NOT NULL,
-            plan       TEXT NOT NULL,
-            amount     INTEGER NOT NULL,
-            method     TEXT NOT NULL,
-            license_key TEXT NOT NULL,
-            timestamp  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        CREATE TABLE IF NOT EXISTS meta (
+            name  TEXT PRIMARY KEY,
+            value TEXT
         )
     """)
 
+    c.execute("SELECT 1 FROM meta WHERE name = 'rollups_backfilled'")
+    if c.fetchone() is None:
+        _backfill_rollups(c)
+
     conn.commit()
     conn.close()
+
+    _init_archive_db()
+    _init_archived_keys_counter()
     logger.info("Database initialized")
 
 
+def _init_archive_db():
+    """Архивная база: те же колонки, что и в горячих таблицах"""
+    conn = sqlite3.connect(ARCHIVE_DB_FILE)
+    c = conn.cursor()
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute(f"CREATE TABLE IF NOT EXISTS license_keys ({LICENSE_KEYS_COLUMNS})")
+    for column, decl in LICENSE_KEYS_ADDED_COLUMNS:
+        _ensure_column(c, "license_keys", column, decl)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_license_keys_user ON license_keys (user_id)")
+    c.execute(f"CREATE TABLE IF NOT EXISTS transactions ({TRANSACTIONS_COLUMNS})")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)")
+    conn.commit()
+    conn.close()
+
+
+def _init_archived_keys_counter():
+    """Счётчик проданных ключей, ушедших в архив (meta.archived_keys) — для «Всего ключей»"""
+    conn = _connect_with_archive()
+    conn.execute("""
+        INSERT OR IGNORE INTO main.meta (name, value)
+        SELECT 'archived_keys', COUNT(*) FROM archive.license_keys WHERE user_id != ?
+    """, (BULK_OWNER_ID,))
+    conn.commit()
+    conn.close()
+
+
+def _connect_with_archive() -> sqlite3.Connection:
+    """Соединение с основной базой и подключённым архивом (схема archive)"""
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_FILE,))
+    return conn
+
+
+def _backfill_rollups(c: sqlite3.Cursor):
+    """Однократно заполнить агрегаты выручки из истории transactions"""
+    for table, fmt in ROLLUP_TABLES.items():
+        c.execute(f"DELETE FROM {table}")
+        c.execute(f"""
+            INSERT INTO {table} (bucket, plan, method, tx_count, stars)
+            SELECT strftime('{fmt}', timestamp), plan, method, COUNT(*), SUM(amount)
+            FROM transactions
+            GROUP BY 1, 2, 3
+        """)
+    c.execute("INSERT INTO meta (name, value) VALUES ('rollups_backfilled', datetime('now'))")
+    logger.info("Revenue rollups backfilled from transactions")
+
+
+def _ensure_column(c: sqlite3.Cursor, table: str, column: str, decl: str):
+    """Добавить колонку в существующую таблицу, если её ещё нет"""
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in c.fetchall()}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _random_key() -> str:
+    return (
+        f"PWEPER"
+        f"-{secrets.token_hex(4).upper()}"
+        f"-{secrets.token_hex(4).upper()}"
+        f"-{secrets.token_hex(4).upper()}"
+    )
+
+
+def _license_expires_at(plan: str) -> str:
+    return (datetime.now() + timedelta(days=PRICES[plan]["days"])).isoformat()
+
+
 def _gen_key() -> str:
     """Генерация уникального ключа в формате PWEPER-XXXXXXXX-XXXXXXXX-XXXXXXXX"""
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
     while True:
-        key = (
-            f"PWEPER"
-            f"-{secrets.token_hex(4).upper()}"
-            f"-{secrets.token_hex(4).upper()}"
-            f"-{secrets.token_hex(4).upper()}"
-        )
+        key = _random_key()
         c.execute("SELECT key FROM license_keys WHERE key = ?", (key,))
         if c.fetchone() is None:
             conn.close()
@@ -139,7 +420,8 @@ def _gen_key() -> str:
 # 🔐 ЗАЩИЩЕННАЯ ФУНКЦИЯ - СИНХРОНИЗАЦИЯ С СЕРВЕРОМ
 # ============================================================================
 
-def sync_key_to_server(key: str, plan: str, expires_at: str) -> bool:
+def sync_key_to_server(key: str, plan: str, expires_at: str,
+                       session: Optional[requests.Session] = None) -> bool:
     """
     Отправляет созданный ключ на сервер Reg.ru с API ключом
     
@@ -147,6 +429,7 @@ def sync_key_to_server(key: str, plan: str, expires_at: str) -> bool:
         key: Ключ активации (например PWEPER-XXXXXXXX-XXXXXXXX-XXXXXXXX)
         plan: Тариф (1month, 3months, lifetime)
         expires_at: Дата истечения в ISO формате
+        session: HTTP-сессия для пакетной отправки (keep-alive)
     
     Returns:
         bool: True если ключ успешно добавлен на сервер, False если ошибка
@@ -168,17 +451,15 @@ def sync_key_to_server(key: str, plan: str, expires_at: str) -> bool:
             "secret": API_SECRET_KEY
         }
         
-        logger.info(f"📤 Отправка ключа на сервер: {key}")
-        logger.info(f"   URL: {url}")
-        logger.info(f"   Данные: {payload}")
-        logger.info(f"   API ключ: {API_SECRET_KEY[:10]}...")
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = (session or requests).post(url, json=payload, headers=headers, timeout=10)
         
         if response.status_code == 200:
             data = response.json()
             if data.get("success"):
-                logger.info(f"✅ Ключ {key} успешно добавлен на сервер")
+                logger.info(
+                    f"✅ Ключ {key} успешно добавлен на сервер",
+                    extra={"event": "key_sync", "key": key, "plan": plan, "sample": True},
+                )
                 return True
             else:
                 logger.error(f"❌ Сервер вернул ошибку: {data.get('error', 'Unknown error')}")
@@ -190,8 +471,10 @@ def sync_key_to_server(key: str, plan: str, expires_at: str) -> bool:
             logger.error(f"❌ Неверный API ключ! Убедитесь что в bot.py и api.php одинаковые ключи.")
             return False
         else:
-            logger.error(f"❌ Сервер вернул код {response.status_code}")
-            logger.error(f"   Ответ: {response.text}")
+            logger.error(
+                f"❌ Сервер вернул код {response.status_code}",
+                extra={"event": "key_sync_failed", "key": key, "response": response.text[:500]},
+            )
             return False
             
     except requests.exceptions.Timeout:
@@ -206,8 +489,7 @@ def create_license(user_id: int, plan: str, method: str,
                    username: str = None, first_name: str = None) -> str:
     """Создать лицензию в SQLite И на сервере, вернуть ключ"""
     key = _gen_key()
-    expires_at = datetime.now() + timedelta(days=PRICES[plan]["days"])
-    expires_at_str = expires_at.isoformat()
+    expires_at_str = _license_expires_at(plan)
 
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
@@ -235,24 +517,166 @@ def create_license(user_id: int, plan: str, method: str,
     conn.commit()
     conn.close()
 
-    logger.info(f"License created locally: {key} | user={user_id} | plan={plan} | method={method}")
-    
+    logger.info(
+        f"License created locally: {key}",
+        extra={"event": "license_created", "key": key, "user_id": user_id, "plan": plan, "method": method,
+               "sample": True},
+    )
+
     # 🔐 Синхронизируем с сервером (с API ключом)
     sync_success = sync_key_to_server(key, plan, expires_at_str)
-    if sync_success:
-        logger.info(f"✅ Ключ {key} синхронизирован с сервером")
-    else:
-        logger.warning(f"⚠️ Ключ {key} создан локально, но НЕ синхронизирован с сервером!")
-        logger.warning(f"   Проверьте: API_SECRET_KEY в bot.py и api.php должны совпадать!")
-    
+    if not sync_success:
+        logger.warning(
+            f"⚠️ Ключ {key} создан локально, но НЕ синхронизирован с сервером! "
+            f"Проверьте: API_SECRET_KEY в bot.py и api.php должны совпадать!",
+            extra={"event": "key_sync_deferred", "key": key},
+        )
+        # Повторная попытка — в фоновой синхронизации
+        mark_keys_synced([key], synced=False)
+
     return key
 
 
-def get_user_licenses(user_id: int) -> List[Dict]:
+def create_licenses_bulk(issued_by: int, plan: str, count: int,
+                         method: str = "admin_bulk") -> str:
+    """
+    Создать пачку лицензий одной транзакцией и выгрузить их в CSV
+
+    Ключи генерируются и вставляются порциями по BULK_CHUNK_SIZE через
+    executemany; каждая порция сразу дописывается в CSV-файл, поэтому в
+    памяти держится только одна порция. На сервер ключи уходят позже,
+    через фоновую синхронизацию (synced = 0).
+
+    Ключи принадлежат BULK_OWNER_ID, а не админу: это товар на перепродажу,
+    и в «Мои лицензии» админа он попадать не должен. Кто выпустил пачку —
+    в issued_by.
+
+    Returns:
+        str: путь к временному CSV-файлу (удаляет вызывающий)
+    """
+    expires_at_str = _license_expires_at(plan)
+
+    csv_file = tempfile.NamedTemporaryFile(
+        "w", suffix=".csv", prefix="keys_", delete=False, newline="", encoding="utf-8"
+    )
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    try:
+        writer = csv.writer(csv_file)
+        writer.writerow(["key", "plan", "expires_at"])
+
+        left = count
+        while left > 0:
+            chunk = {_random_key() for _ in range(min(left, BULK_CHUNK_SIZE))}
+            placeholders = ",".join("?" * len(chunk))
+            c.execute(f"SELECT key FROM license_keys WHERE key IN ({placeholders})", tuple(chunk))
+            chunk.difference_update(row[0] for row in c.fetchall())
+
+            c.executemany("""
+                INSERT INTO license_keys (key, user_id, plan, expires_at, payment_method, synced, issued_by)
+                VALUES (?, ?, ?, ?, ?, 0, ?)
+            """, ((key, BULK_OWNER_ID, plan, expires_at_str, method, issued_by) for key in chunk))
+            writer.writerows((key, plan, expires_at_str) for key in chunk)
+            left -= len(chunk)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        csv_file.close()
+        os.remove(csv_file.name)
+        raise
+    finally:
+        conn.close()
+
+    csv_file.close()
+    logger.info(f"Bulk licenses created locally: {count} | issued_by={issued_by} | plan={plan} | method={method}")
+    return csv_file.name
+
+
+def mark_keys_synced(keys: List[str], synced: bool = True):
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.executemany(
+        "UPDATE license_keys SET synced = ? WHERE key = ?",
+        ((int(synced), key) for key in keys),
+    )
+    conn.commit()
+    conn.close()
+
+
+def record_sync_failures(keys: List[str]) -> List[str]:
+    """
+    Засчитать ключам неудачную попытку синхронизации
+
+    Returns:
+        List[str]: ключи, исчерпавшие SYNC_MAX_ATTEMPTS на этой попытке
+    """
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.executemany("""
+        UPDATE license_keys
+        SET sync_attempts = sync_attempts + 1, last_sync_attempt = CURRENT_TIMESTAMP
+        WHERE key = ?
+    """, ((key,) for key in keys))
+    placeholders = ",".join("?" * len(keys))
+    c.execute(
+        f"SELECT key FROM license_keys WHERE key IN ({placeholders}) AND sync_attempts = ?",
+        (*keys, SYNC_MAX_ATTEMPTS),
+    )
+    given_up = [row[0] for row in c.fetchall()]
+    conn.commit()
+    conn.close()
+    return given_up
+
+
+def get_unsynced_keys(limit: int) -> List[Dict]:
+    """Ключи для синхронизации: новые (без попыток) и давно не пробованные первыми"""
     conn = sqlite3.connect(DB_FILE)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    c.execute("SELECT * FROM license_keys WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
+    c.execute("""
+        SELECT key, plan, expires_at FROM license_keys
+        WHERE synced = 0 AND sync_attempts < ?
+        ORDER BY last_sync_attempt
+        LIMIT ?
+    """, (SYNC_MAX_ATTEMPTS, limit))
+    rows = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return rows
+
+
+def sync_keys_batch(rows: List[Dict]) -> List[str]:
+    """Отправить пачку ключей на сервер через одну HTTP-сессию, вернуть успешные"""
+    done = []
+    with requests.Session() as session:
+        for row in rows:
+            if sync_key_to_server(row["key"], row["plan"], row["expires_at"], session=session):
+                done.append(row["key"])
+    return done
+
+
+def get_user_licenses(user_id: int, include_archived: bool = False,
+                      limit: Optional[int] = None) -> List[Dict]:
+    """Лицензии пользователя, новые первыми; архив читается только при include_archived"""
+    if include_archived:
+        conn = _connect_with_archive()
+        query = """
+            SELECT * FROM main.license_keys WHERE user_id = ?
+            UNION ALL
+            SELECT * FROM archive.license_keys WHERE user_id = ?
+            ORDER BY created_at DESC
+        """
+        params = (user_id, user_id)
+    else:
+        conn = sqlite3.connect(DB_FILE)
+        query = "SELECT * FROM license_keys WHERE user_id = ? ORDER BY created_at DESC"
+        params = (user_id,)
+    if limit is not None:
+        query += " LIMIT ?"
+        params += (limit,)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(query, params)
     rows = c.fetchall()
     conn.close()
 
@@ -278,6 +702,19 @@ def add_transaction(user_id: int, plan: str, amount: int, method: str, key: str)
         INSERT INTO transactions (user_id, plan, amount, method, license_key)
         VALUES (?, ?, ?, ?, ?)
     """, (user_id, plan, amount, method, key))
+
+    # Агрегаты обновляются в той же транзакции, корзина — по timestamp новой строки
+    tx_id = c.lastrowid
+    for table, fmt in ROLLUP_TABLES.items():
+        c.execute(f"""
+            INSERT INTO {table} (bucket, plan, method, tx_count, stars)
+            SELECT strftime('{fmt}', timestamp), plan, method, 1, amount
+            FROM transactions WHERE id = ?
+            ON CONFLICT (bucket, plan, method) DO UPDATE SET
+                tx_count = tx_count + excluded.tx_count,
+                stars    = stars + excluded.stars
+        """, (tx_id,))
+
     conn.commit()
     conn.close()
 
@@ -290,35 +727,416 @@ def get_stats() -> Dict:
     c.execute("SELECT COUNT(*) as n FROM users")
     total_users = c.fetchone()["n"]
 
-    c.execute("SELECT COUNT(*) as n FROM license_keys")
+    # Пакетные ключи на перепродажу считаются отдельно, чтобы не размывать продажи
+    # Всего ключей за всё время: основная база + счётчик ушедших в архив
+    c.execute("""
+        SELECT COUNT(*) + COALESCE((SELECT CAST(value AS INTEGER) FROM meta WHERE name = 'archived_keys'), 0) as n
+        FROM license_keys WHERE user_id != ?
+    """, (BULK_OWNER_ID,))
     total_keys = c.fetchone()["n"]
 
-    c.execute("SELECT COUNT(*) as n FROM license_keys WHERE datetime(expires_at) > datetime('now')")
+    c.execute("""
+        SELECT COUNT(*) as n FROM license_keys
+        WHERE user_id != ? AND datetime(expires_at) > datetime('now')
+    """, (BULK_OWNER_ID,))
     active_keys = c.fetchone()["n"]
 
-    c.execute("SELECT COUNT(*) as n FROM transactions")
-    total_tx = c.fetchone()["n"]
+    c.execute("SELECT COUNT(*) as n FROM license_keys WHERE user_id = ?", (BULK_OWNER_ID,))
+    bulk_keys = c.fetchone()["n"]
 
-    c.execute("SELECT SUM(amount) as s FROM transactions")
-    total_stars = c.fetchone()["s"] or 0
+    # Итоги по транзакциям — из дневных агрегатов, без скана transactions
+    c.execute("SELECT SUM(tx_count) as n, SUM(stars) as s FROM revenue_daily")
+    row = c.fetchone()
+    total_tx    = row["n"] or 0
+    total_stars = row["s"] or 0
 
     conn.close()
     return {
         "total_users":  total_users,
         "total_keys":   total_keys,
         "active_keys":  active_keys,
+        "bulk_keys":    bulk_keys,
         "total_tx":     total_tx,
         "total_stars":  total_stars,
     }
 
 
+def get_revenue_trend(days: int = TREND_DAYS) -> Dict:
+    """
+    Выручка по дням за последние days дней (UTC) из revenue_daily
+
+    Returns:
+        Dict: {"days": [{"day", "tx", "stars"}, ...] без пропусков,
+               "plans": {plan: {"tx", "stars"}} за весь период}
+    """
+    start = (datetime.now(timezone.utc).date() - timedelta(days=days - 1)).isoformat()
+
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("""
+        SELECT bucket, plan, SUM(tx_count) as tx, SUM(stars) as stars
+        FROM revenue_daily
+        WHERE bucket >= ?
+        GROUP BY bucket, plan
+    """, (start,))
+    rows = c.fetchall()
+    conn.close()
+
+    per_day = {}
+    plans = {}
+    for row in rows:
+        day = per_day.setdefault(row["bucket"], {"tx": 0, "stars": 0})
+        day["tx"]    += row["tx"]
+        day["stars"] += row["stars"]
+        plan = plans.setdefault(row["plan"], {"tx": 0, "stars": 0})
+        plan["tx"]    += row["tx"]
+        plan["stars"] += row["stars"]
+
+    result = []
+    for i in range(days):
+        day = (datetime.fromisoformat(start) + timedelta(days=i)).date().isoformat()
+        totals = per_day.get(day, {"tx": 0, "stars": 0})
+        result.append({"day": day, "tx": totals["tx"], "stars": totals["stars"]})
+    return {"days": result, "plans": plans}
+
+
+# ============================================================================
+# АРХИВ (ИСТЁКШИЕ КЛЮЧИ И СТАРЫЕ ТРАНЗАКЦИИ)
+# ============================================================================
+
+# Таблица → (первичный ключ, условие «пора в архив»)
+# Несинхронизированные ключи остаются в основной базе, иначе sync_worker их не увидит
+ARCHIVE_RULES = {
+    "license_keys": ("key", "expires_at < ? AND synced = 1"),
+    "transactions": ("id",  "timestamp < ?"),
+}
+
+
+def archive_batch(table: str, cutoff: str, limit: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Перенести одну пачку строк table старше cutoff в архив
+
+    Сначала строки копируются в архив и эта транзакция фиксируется, потом
+    отдельной транзакцией удаляются из основной базы. Обе базы в WAL, а
+    транзакция через ATTACH в WAL-режиме не атомарна между файлами. Поэтому
+    порядок «сначала архив» нужен, чтобы сбой между коммитами не терял
+    строки. Повтор после сбоя безопасен: INSERT OR REPLACE просто
+    перезапишет копию. Каждая транзакция покрывает одну пачку, так что
+    блокировка основной базы держится недолго.
+
+    Returns:
+        int: сколько строк перенесено (0 — переносить больше нечего)
+    """
+    pk, condition = ARCHIVE_RULES[table]
+
+    conn = _connect_with_archive()
+    c = conn.cursor()
+    try:
+        c.execute(f"SELECT {pk} FROM main.{table} WHERE {condition} LIMIT ?", (cutoff, limit))
+        ids = [row[0] for row in c.fetchall()]
+        if ids:
+            placeholders = ",".join("?" * len(ids))
+            c.execute(f"""
+                INSERT OR REPLACE INTO archive.{table}
+                SELECT * FROM main.{table} WHERE {pk} IN ({placeholders})
+            """, ids)
+            conn.commit()
+            if table == "license_keys":
+                # Счётчик обновляется в одной транзакции с удалением — без двойного учёта при повторе
+                c.execute(f"""
+                    UPDATE main.meta
+                    SET value = CAST(value AS INTEGER) + (
+                        SELECT COUNT(*) FROM main.license_keys
+                        WHERE key IN ({placeholders}) AND user_id != ?
+                    )
+                    WHERE name = 'archived_keys'
+                """, (*ids, BULK_OWNER_ID))
+            c.execute(f"DELETE FROM main.{table} WHERE {pk} IN ({placeholders})", ids)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(ids)
+
+
+def _archive_cutoffs() -> Dict[str, str]:
+    # expires_at — локальное время в ISO, timestamp — UTC от CURRENT_TIMESTAMP
+    return {
+        "license_keys": (datetime.now() - timedelta(days=ARCHIVE_KEYS_GRACE_DAYS)).isoformat(),
+        "transactions": (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_TX_DAYS)).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+async def run_archiver() -> Dict[str, int]:
+    """Перенести в архив всё, что устарело, пачками с паузами между ними"""
+    moved = {}
+    for table, cutoff in _archive_cutoffs().items():
+        moved[table] = 0
+        while True:
+            n = await asyncio.to_thread(archive_batch, table, cutoff)
+            moved[table] += n
+            if n < ARCHIVE_BATCH_SIZE:
+                break
+            # Уступаем базу покупкам и остальным запросам
+            await asyncio.sleep(ARCHIVE_PAUSE)
+    logger.info(f"Archiver: moved {moved['license_keys']} keys, {moved['transactions']} transactions")
+    return moved
+
+
+async def archive_worker():
+    while True:
+        try:
+            await run_archiver()
+        except Exception as e:
+            logger.error(f"Archiver error: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+# ============================================================================
+# РЕЗЕРВНОЕ КОПИРОВАНИЕ
+# ============================================================================
+
+def backup_database(db_file: str) -> str:
+    """
+    Онлайн-бэкап базы в BACKUP_DIR/<имя>_<время>.db.gz
+
+    Копия снимается через SQLite backup API по BACKUP_PAGES страниц за шаг
+    с паузой между шагами. Источник держит одну читающую транзакцию на всё
+    время копирования: в WAL-режиме это согласованный снимок, который не
+    мешает create_license писать, и бэкап не перезапускается от их записей.
+    Блокирующая функция, вызывать через run_backups (там же блокировка).
+
+    Копия пишется в .part и переименовывается только целиком, так что
+    недописанный файл никогда не попадает в list_backups().
+
+    Returns:
+        str: путь к сжатой копии
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = os.path.splitext(os.path.basename(db_file))[0]
+    path = os.path.join(BACKUP_DIR, f"{name}_{datetime.now():%Y%m%d_%H%M%S_%f}.db.gz")
+    tmp_path  = path[:-len(".gz")] + ".tmp"
+    part_path = path + ".part"
+
+    started = time.monotonic()
+    try:
+        src = sqlite3.connect(db_file, isolation_level=None)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            src.backup(dst, pages=BACKUP_PAGES, progress=lambda *_: time.sleep(BACKUP_STEP_PAUSE))
+            src.execute("COMMIT")
+        finally:
+            dst.close()
+            src.close()
+
+        with open(tmp_path, "rb") as f_in, gzip.open(part_path, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.replace(part_path, path)
+    finally:
+        for leftover in (tmp_path, part_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    _rotate_backups(name)
+    logger.info(f"Backup done: {path} | {os.path.getsize(path)} bytes | {time.monotonic() - started:.1f}s")
+    return path
+
+
+def _rotate_backups(name: str):
+    """Оставить BACKUP_KEEP последних копий базы name"""
+    for old in list_backups(name)[BACKUP_KEEP:]:
+        os.remove(old)
+        logger.info(f"Backup removed by rotation: {old}")
+
+
+def list_backups(name: Optional[str] = None) -> List[str]:
+    """Копии в BACKUP_DIR (все или только базы name), новые первыми"""
+    if name is None:
+        return sorted(glob.glob(os.path.join(BACKUP_DIR, "*.db.gz")), key=os.path.getmtime, reverse=True)
+    # Цифра после "_" отсекает чужие базы с тем же префиксом (licenses_archive_...),
+    # время в имени файла сортируется как строка
+    pattern = f"{name}_[0-9]*.db.gz"
+    return sorted(glob.glob(os.path.join(BACKUP_DIR, pattern)), reverse=True)
+
+
+def verify_backup(path: str) -> Dict:
+    """
+    Проверить, что из копии восстанавливается рабочая база
+
+    Распаковывает копию во временный файл, выполняет PRAGMA integrity_check
+    и считает строки во всех таблицах.
+
+    Returns:
+        Dict: {"ok": bool, "integrity": str, "tables": {table: rows}}
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=".db", prefix="verify_")
+    os.close(fd)
+    try:
+        with gzip.open(path, "rb") as f_in, open(tmp_path, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+
+        conn = sqlite3.connect(tmp_path)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            )]
+            counts = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+        finally:
+            conn.close()
+    finally:
+        os.remove(tmp_path)
+
+    return {"ok": integrity == "ok", "integrity": integrity, "tables": counts}
+
+
+# /backup и backup_worker не должны копировать одновременно
+backup_lock = asyncio.Lock()
+
+
+async def run_backups() -> List[str]:
+    paths = []
+    async with backup_lock:
+        for db_file in (DB_FILE, ARCHIVE_DB_FILE):
+            if os.path.exists(db_file):
+                paths.append(await asyncio.to_thread(backup_database, db_file))
+    return paths
+
+
+async def backup_worker():
+    while True:
+        try:
+            await run_backups()
+        except Exception as e:
+            logger.error(f"Backup error: {e}")
+        await asyncio.sleep(BACKUP_INTERVAL)
+
+
+# ============================================================================
+# ЭКСПОРТ ДЛЯ БУХГАЛТЕРИИ
+# ============================================================================
+
+# Таблица для экспорта: (имя в SQLite, колонка даты для фильтра)
+EXPORT_TABLES = {
+    "tx":   ("transactions", "timestamp"),
+    "keys": ("license_keys", "created_at"),
+}
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+def _iter_export_rows(c: sqlite3.Cursor, table: str, date_from: Optional[str] = None,
+                      date_to: Optional[str] = None, plan: Optional[str] = None,
+                      archived: bool = False) -> Iterator[tuple]:
+    """Строки таблицы порциями по EXPORT_CHUNK_SIZE через fetchmany
+
+    С archived=True к горячей таблице добавляется архивная (курсор должен
+    быть от _connect_with_archive).
+    """
+    name, date_col = EXPORT_TABLES[table]
+    where, params = [], []
+    if date_from:
+        where.append(f"{date_col} >= ?")
+        params.append(date_from)
+    if date_to:
+        # date_to включительно: всё, что раньше следующего дня
+        where.append(f"{date_col} < date(?, '+1 day')")
+        params.append(date_to)
+    if plan:
+        where.append("plan = ?")
+        params.append(plan)
+
+    sources = [f"main.{name}", f"archive.{name}"] if archived else [name]
+    query = " UNION ALL ".join(
+        f"SELECT * FROM {source}" + (" WHERE " + " AND ".join(where) if where else "")
+        for source in sources
+    )
+    # Хронологический порядок и для горячих, и для архивных строк вместе
+    query += f" ORDER BY {date_col}"
+
+    c.execute(query, params * len(sources))
+    while True:
+        chunk = c.fetchmany(EXPORT_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield from chunk
+
+
+def _csv_lines(columns: List[str], rows: Iterator[tuple]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in itertools.chain([columns], rows):
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def _jsonl_lines(columns: List[str], rows: Iterator[tuple]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+
+
+def export_table(table: str, fmt: str, date_from: Optional[str] = None,
+                 date_to: Optional[str] = None, plan: Optional[str] = None,
+                 archived: bool = False) -> Tuple[str, int]:
+    """
+    Выгрузить таблицу в сжатый gzip файл, не загружая её в память целиком
+
+    Строки идут конвейером генераторов: курсор (fetchmany) → форматирование
+    CSV/JSONL → gzip. Блокирующая функция, вызывать через asyncio.to_thread.
+
+    Returns:
+        Tuple[str, int]: путь к временному .gz файлу (удаляет вызывающий) и число строк
+    """
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz", prefix=f"export_{table}_")
+    os.close(fd)
+
+    conn = _connect_with_archive() if archived else sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    count = 0
+    try:
+        rows = _iter_export_rows(c, table, date_from, date_to, plan, archived)
+        # Первый next() выполняет запрос, после него известны колонки
+        first = next(rows, None)
+        columns = [d[0] for d in c.description]
+
+        def counted():
+            nonlocal count
+            for row in itertools.chain([first] if first is not None else [], rows):
+                count += 1
+                yield row
+
+        lines = _csv_lines if fmt == "csv" else _jsonl_lines
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+            for line in lines(columns, counted()):
+                f.write(line)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        conn.close()
+
+    logger.info(
+        f"Export done: {table}.{fmt} | rows={count} | from={date_from} | to={date_to} "
+        f"| plan={plan} | archived={archived}"
+    )
+    return path, count
+
+
 # ============================================================================
 # FSM СОСТОЯНИЯ
 # ============================================================================
 
 class AdminStates(StatesGroup):
-    waiting_user_id = State()
-    waiting_plan    = State()
+    waiting_user_id    = State()
+    waiting_plan       = State()
+    waiting_bulk_plan  = State()
+    waiting_bulk_count = State()
 
 
 # ============================================================================
@@ -371,20 +1189,32 @@ def back_kb() -> InlineKeyboardMarkup:
     ])
 
 
+def my_licenses_kb(show_archived: bool) -> InlineKeyboardMarkup:
+    rows = []
+    if not show_archived:
+        rows.append([InlineKeyboardButton(text="🗄 Показать истёкшие", callback_data="my_licenses_all")])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="main")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 def admin_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🎁 Выдать ключ", callback_data="admin_give_key")],
+        [InlineKeyboardButton(text="📦 Пакет ключей", callback_data="admin_bulk_keys")],
         [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton(text="📈 Динамика", callback_data="admin_trend")],
+        [InlineKeyboardButton(text="📤 Экспорт", callback_data="admin_export")],
+        [InlineKeyboardButton(text="💾 Бэкапы", callback_data="admin_backups")],
         [InlineKeyboardButton(text="🔧 Тест API", callback_data="admin_test_api")],
         [InlineKeyboardButton(text="🔙 Назад", callback_data="main")]
     ])
 
 
-def admin_plan_kb() -> InlineKeyboardMarkup:
+def admin_plan_kb(prefix: str = "admin_plan_") -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=PRICES["1month"]["name"], callback_data="admin_plan_1month")],
-        [InlineKeyboardButton(text=PRICES["3months"]["name"], callback_data="admin_plan_3months")],
-        [InlineKeyboardButton(text=PRICES["lifetime"]["name"], callback_data="admin_plan_lifetime")],
+        [InlineKeyboardButton(text=PRICES["1month"]["name"], callback_data=f"{prefix}1month")],
+        [InlineKeyboardButton(text=PRICES["3months"]["name"], callback_data=f"{prefix}3months")],
+        [InlineKeyboardButton(text=PRICES["lifetime"]["name"], callback_data=f"{prefix}lifetime")],
         [InlineKeyboardButton(text="❌ Отмена", callback_data="admin_panel")]
     ])
 
@@ -523,11 +1353,15 @@ async def process_successful_payment(message: types.Message):
 # МОИ ЛИЦЕНЗИИ
 # ============================================================================
 
-@dp.callback_query(F.data == "my_licenses")
+@dp.callback_query(F.data.in_({"my_licenses", "my_licenses_all"}))
 async def cb_my_licenses(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    licenses = get_user_licenses(user_id)
-    
+    show_archived = callback.data == "my_licenses_all"
+    # На одну больше лимита — чтобы знать, что показаны не все
+    licenses = get_user_licenses(user_id, include_archived=show_archived, limit=MY_LICENSES_LIMIT + 1)
+    truncated = len(licenses) > MY_LICENSES_LIMIT
+    licenses = licenses[:MY_LICENSES_LIMIT]
+
     if not licenses:
         text = "У вас пока нет лицензий.\n\nНажмите «Купить лицензию», чтобы приобрести."
     else:
@@ -543,8 +1377,10 @@ async def cb_my_licenses(callback: types.CallbackQuery):
                 f"{status} | {activated}\n"
                 f"━━━━━━━━━━━━━━━\n"
             )
+        if truncated:
+            text += f"Показаны последние {MY_LICENSES_LIMIT}. За остальными обратитесь к @{SELLER_USERNAME}\n"
 
-    await callback.message.edit_text(text, reply_markup=back_kb(), parse_mode="HTML")
+    await callback.message.edit_text(text, reply_markup=my_licenses_kb(show_archived), parse_mode="HTML")
     await callback.answer()
 
 
@@ -590,6 +1426,7 @@ async def cmd_admin(message: types.Message):
         f"👥 Пользователей: {stats['total_users']}\n"
         f"🔑 Всего ключей: {stats['total_keys']}\n"
         f"✅ Активных: {stats['active_keys']}\n"
+        f"📦 Пакетных (на перепродажу): {stats['bulk_keys']}\n"
         f"💰 Транзакций: {stats['total_tx']}\n"
         f"⭐ Заработано: {stats['total_stars']} звёзд"
     )
@@ -597,16 +1434,19 @@ async def cmd_admin(message: types.Message):
 
 
 @dp.callback_query(F.data == "admin_panel")
-async def cb_admin_panel(callback: types.CallbackQuery):
+async def cb_admin_panel(callback: types.CallbackQuery, state: FSMContext):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
+    # «❌ Отмена» в диалогах выдачи ключей ведёт сюда — сбрасываем ожидание ввода
+    await state.clear()
     stats = get_stats()
     text = (
         "⚙️ <b>Админ-панель</b>\n\n"
         f"👥 Пользователей: {stats['total_users']}\n"
         f"🔑 Всего ключей: {stats['total_keys']}\n"
         f"✅ Активных: {stats['active_keys']}\n"
+        f"📦 Пакетных (на перепродажу): {stats['bulk_keys']}\n"
         f"💰 Транзакций: {stats['total_tx']}\n"
         f"⭐ Заработано: {stats['total_stars']} звёзд"
     )
@@ -685,6 +1525,82 @@ async def admin_create_key(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
 
 
+# ─── Пакет ключей ──────────────────────────────────────────────────────────────
+
+@dp.callback_query(F.data == "admin_bulk_keys")
+async def cb_admin_bulk_keys(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    await callback.message.edit_text(
+        "📦 <b>Пакет ключей</b>\n\nВыберите план:",
+        reply_markup=admin_plan_kb("admin_bulk_plan_"),
+        parse_mode="HTML",
+    )
+    await state.set_state(AdminStates.waiting_bulk_plan)
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("admin_bulk_plan_"), AdminStates.waiting_bulk_plan)
+async def admin_bulk_plan(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_IDS:
+        return
+    plan = callback.data.replace("admin_bulk_plan_", "")
+    await state.update_data(plan=plan)
+    await callback.message.edit_text(
+        f"📦 План: {PRICES[plan]['name']}\n\n"
+        f"🔢 Введите количество ключей (1–{BULK_MAX_KEYS}):",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="admin_panel")]
+        ]),
+        parse_mode="HTML",
+    )
+    await state.set_state(AdminStates.waiting_bulk_count)
+    await callback.answer()
+
+
+@dp.message(AdminStates.waiting_bulk_count)
+async def admin_bulk_create(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    try:
+        count = int(message.text.strip())
+    except (ValueError, AttributeError):
+        await message.answer("❌ Неверный формат. Введите число.")
+        return
+    if not 1 <= count <= BULK_MAX_KEYS:
+        await message.answer(f"❌ Количество должно быть от 1 до {BULK_MAX_KEYS}.")
+        return
+
+    data = await state.get_data()
+    plan = data["plan"]
+    await state.clear()
+
+    # Генерация и запись в БД — в отдельном потоке, чтобы не блокировать бота
+    try:
+        path = await asyncio.to_thread(create_licenses_bulk, message.from_user.id, plan, count)
+    except Exception as e:
+        logger.error(f"Bulk key creation error: {e}")
+        await message.answer(f"❌ Ошибка создания ключей: {e}", reply_markup=admin_menu_kb())
+        return
+
+    sync_wakeup.set()
+
+    try:
+        await message.answer_document(
+            FSInputFile(path, filename=f"keys_{plan}_{count}_{datetime.now():%Y%m%d_%H%M%S}.csv"),
+            caption=(
+                f"✅ <b>Создано ключей: {count}</b>\n"
+                f"📦 План: {PRICES[plan]['name']}\n\n"
+                f"🔄 Ключи синхронизируются с сервером в фоне"
+            ),
+            reply_markup=admin_menu_kb(),
+            parse_mode="HTML",
+        )
+    finally:
+        os.remove(path)
+
+
 # ─── Статистика ────────────────────────────────────────────────────────────────
 
 @dp.callback_query(F.data == "admin_stats")
@@ -698,6 +1614,7 @@ async def cb_admin_stats(callback: types.CallbackQuery):
         f"👥 Всего пользователей: {stats['total_users']}\n"
         f"🔑 Всего ключей: {stats['total_keys']}\n"
         f"✅ Активных ключей: {stats['active_keys']}\n"
+        f"📦 Пакетных ключей (на перепродажу): {stats['bulk_keys']}\n"
         f"💰 Всего транзакций: {stats['total_tx']}\n"
         f"⭐ Заработано звёзд: {stats['total_stars']}"
     )
@@ -705,6 +1622,207 @@ async def cb_admin_stats(callback: types.CallbackQuery):
     await callback.answer()
 
 
+# ─── Динамика выручки ──────────────────────────────────────────────────────────
+
+@dp.callback_query(F.data == "admin_trend")
+async def cb_admin_trend(callback: types.CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    trend = get_revenue_trend()
+    peak = max((d["stars"] for d in trend["days"]), default=0) or 1
+
+    text = f"📈 <b>Выручка за {TREND_DAYS} дней</b> (UTC)\n\n<code>"
+    for d in trend["days"]:
+        bar = "▇" * round(d["stars"] / peak * 12)
+        text += f"{d['day'][5:]} {bar:<12} {d['stars']:>5}⭐ ({d['tx']})\n"
+    text += "</code>\n"
+
+    total_stars = sum(d["stars"] for d in trend["days"])
+    total_tx    = sum(d["tx"] for d in trend["days"])
+    text += f"⭐ Итого: {total_stars} звёзд, {total_tx} транзакций\n"
+    for plan, totals in trend["plans"].items():
+        text += f"📦 {PRICES.get(plan, {}).get('name', plan)}: {totals['stars']}⭐ ({totals['tx']})\n"
+
+    await callback.message.edit_text(text, reply_markup=admin_menu_kb(), parse_mode="HTML")
+    await callback.answer()
+
+
+# ─── Экспорт ───────────────────────────────────────────────────────────────────
+
+EXPORT_USAGE = (
+    "📤 <b>Экспорт для бухгалтерии</b>\n\n"
+    "<code>/export tx|keys [csv|jsonl] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] [план] [all]</code>\n\n"
+    "<b>Примеры:</b>\n"
+    "<code>/export tx</code> — все транзакции в CSV\n"
+    "<code>/export tx jsonl 2026-10-01 2026-10-31</code>\n"
+    "<code>/export keys csv 2026-01-01 lifetime</code>\n"
+    "<code>/export tx all</code> — вместе с архивом\n\n"
+    f"Планы: {', '.join(PRICES)}\n"
+    "Файл приходит сжатым (.gz)"
+)
+
+
+def _parse_export_args(args: List[str]) -> Dict:
+    """Разобрать аргументы /export, ValueError с текстом для админа при ошибке"""
+    if not args or args[0] not in EXPORT_TABLES:
+        raise ValueError("Укажите таблицу: tx или keys")
+    params = {"table": args[0], "fmt": "csv", "date_from": None, "date_to": None,
+              "plan": None, "archived": False}
+    for arg in args[1:]:
+        if arg in EXPORT_FORMATS:
+            params["fmt"] = arg
+        elif arg == "all":
+            params["archived"] = True
+        elif arg in PRICES:
+            params["plan"] = arg
+        else:
+            try:
+                datetime.strptime(arg, "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"Непонятный аргумент: {arg}")
+            if params["date_from"] is None:
+                params["date_from"] = arg
+            elif params["date_to"] is None:
+                params["date_to"] = arg
+            else:
+                raise ValueError("Можно указать не больше двух дат")
+    return params
+
+
+@dp.callback_query(F.data == "admin_export")
+async def cb_admin_export(callback: types.CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    await callback.message.edit_text(EXPORT_USAGE, reply_markup=admin_menu_kb(), parse_mode="HTML")
+    await callback.answer()
+
+
+@dp.message(Command("export"))
+async def cmd_export(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Нет доступа")
+        return
+    try:
+        params = _parse_export_args(message.text.split()[1:])
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n\n{EXPORT_USAGE}", parse_mode="HTML")
+        return
+
+    await message.answer("⏳ Готовлю выгрузку...")
+
+    # Чтение и сжатие — в отдельном потоке, чтобы не блокировать бота
+    try:
+        path, count = await asyncio.to_thread(export_table, **params)
+    except Exception as e:
+        logger.error(f"Export error: {e}")
+        await message.answer(f"❌ Ошибка экспорта: {e}")
+        return
+
+    size = os.path.getsize(path)
+    if size > EXPORT_MAX_BYTES:
+        os.remove(path)
+        await message.answer(
+            f"❌ Выгрузка слишком большая: {size // (1024 * 1024)} МБ "
+            f"при лимите Telegram {EXPORT_MAX_BYTES // (1024 * 1024)} МБ.\n\n"
+            f"Сузьте диапазон дат или укажите план."
+        )
+        return
+
+    table, fmt = params["table"], params["fmt"]
+    filters = ", ".join(
+        f"{label}: {params[name]}"
+        for name, label in (("date_from", "с"), ("date_to", "по"), ("plan", "план"))
+        if params[name]
+    )
+    if params["archived"]:
+        filters = ", ".join(filter(None, [filters, "с архивом"]))
+    try:
+        await message.answer_document(
+            FSInputFile(path, filename=f"{EXPORT_TABLES[table][0]}_{datetime.now():%Y%m%d_%H%M%S}.{fmt}.gz"),
+            caption=(
+                f"📤 <b>{EXPORT_TABLES[table][0]}</b> ({fmt})\n"
+                f"📄 Строк: {count}"
+                + (f"\n🔎 {filters}" if filters else "")
+            ),
+            parse_mode="HTML",
+        )
+    finally:
+        os.remove(path)
+
+
+# ─── Бэкапы ────────────────────────────────────────────────────────────────────
+
+@dp.callback_query(F.data == "admin_backups")
+async def cb_admin_backups(callback: types.CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    backups = list_backups()
+    text = f"💾 <b>Резервные копии</b> ({len(backups)})\n\n"
+    for path in backups[:10]:
+        text += f"<code>{os.path.basename(path)}</code> — {os.path.getsize(path) // 1024} КБ\n"
+    if not backups:
+        text += "Копий пока нет.\n"
+    text += (
+        "\n<code>/backup</code> — сделать копию сейчас\n"
+        "<code>/verify_backup [файл]</code> — проверить восстановление (по умолчанию последняя)"
+    )
+    await callback.message.edit_text(text, reply_markup=admin_menu_kb(), parse_mode="HTML")
+    await callback.answer()
+
+
+@dp.message(Command("backup"))
+async def cmd_backup(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Нет доступа")
+        return
+    await message.answer("⏳ Создаю резервную копию...")
+    try:
+        paths = await run_backups()
+    except Exception as e:
+        logger.error(f"Backup error: {e}")
+        await message.answer(f"❌ Ошибка бэкапа: {e}")
+        return
+    text = "✅ <b>Копии созданы:</b>\n\n" + "\n".join(
+        f"<code>{os.path.basename(p)}</code> — {os.path.getsize(p) // 1024} КБ" for p in paths
+    )
+    await message.answer(text, parse_mode="HTML")
+
+
+@dp.message(Command("verify_backup"))
+async def cmd_verify_backup(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Нет доступа")
+        return
+    args = message.text.split()[1:]
+    if args:
+        path = os.path.join(BACKUP_DIR, os.path.basename(args[0]))
+        if path not in list_backups():
+            await message.answer("❌ Копия не найдена")
+            return
+    else:
+        backups = list_backups(os.path.splitext(os.path.basename(DB_FILE))[0])
+        if not backups:
+            await message.answer("❌ Копий пока нет")
+            return
+        path = backups[0]
+
+    try:
+        result = await asyncio.to_thread(verify_backup, path)
+    except Exception as e:
+        logger.error(f"Backup verification error: {e}")
+        await message.answer(f"❌ Копия не восстанавливается: {e}")
+        return
+
+    status = "✅ Копия в порядке" if result["ok"] else f"❌ Повреждена: {result['integrity']}"
+    text = f"🔍 <b>{os.path.basename(path)}</b>\n\n{status}\n\n" + "\n".join(
+        f"• {table}: {rows}" for table, rows in result["tables"].items()
+    )
+    await message.answer(text, parse_mode="HTML")
+
+
 # ─── Тест API ──────────────────────────────────────────────────────────────────
 
 @dp.callback_query(F.data == "admin_test_api")
@@ -751,6 +1869,47 @@ async def cb_test_api(callback: types.CallbackQuery):
     await callback.message.edit_text(text, reply_markup=admin_menu_kb(), parse_mode="HTML")
 
 
+# ============================================================================
+# ФОНОВАЯ СИНХРОНИЗАЦИЯ С СЕРВЕРОМ
+# ============================================================================
+
+sync_wakeup = asyncio.Event()
+
+
+async def sync_worker():
+    """Досылает на сервер ключи с synced = 0 пачками по SYNC_BATCH_SIZE"""
+    while True:
+        try:
+            rows = await asyncio.to_thread(get_unsynced_keys, SYNC_BATCH_SIZE)
+            if rows:
+                done = await asyncio.to_thread(sync_keys_batch, rows)
+                if done:
+                    await asyncio.to_thread(mark_keys_synced, done)
+                done_keys = set(done)
+                failed = [row["key"] for row in rows if row["key"] not in done_keys]
+                if failed:
+                    given_up = await asyncio.to_thread(record_sync_failures, failed)
+                    if given_up:
+                        logger.error(
+                            f"❌ {len(given_up)} ключей не синхронизированы после "
+                            f"{SYNC_MAX_ATTEMPTS} попыток, повторов больше не будет: {', '.join(given_up)}",
+                            extra={"event": "key_sync_given_up", "count": len(given_up)},
+                        )
+                logger.info(f"Sync batch: {len(done)}/{len(rows)} keys synced")
+                # Пачка прошла целиком — сразу берём следующую,
+                # иначе сервер недоступен и ждём следующего прохода
+                if len(done) == len(rows):
+                    continue
+        except Exception as e:
+            logger.error(f"Sync worker error: {e}")
+
+        sync_wakeup.clear()
+        try:
+            await asyncio.wait_for(sync_wakeup.wait(), timeout=SYNC_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
 # ============================================================================
 # ЗАПУСК
 # ============================================================================
@@ -777,15 +1936,21 @@ async def main():
         logger.warning("ADMIN_IDS не заданы — админ-панель недоступна")
 
     logger.info(f"API URL: {API_URL}")
-    logger.info(f"API Key: {API_SECRET_KEY[:10]}... (первые 10 символов)")
     logger.info(f"Seller: @{SELLER_USERNAME}")
     logger.info("=" * 50)
 
+    sync_task    = asyncio.create_task(sync_worker())
+    archive_task = asyncio.create_task(archive_worker())
+    backup_task  = asyncio.create_task(backup_worker())
+
     try:
         await dp.start_polling(bot, skip_updates=True)
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        sync_task.cancel()
+        archive_task.cancel()
+        backup_task.cancel()
         await bot.session.close()
 
 